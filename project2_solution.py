@@ -1,13 +1,22 @@
+import argparse
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Tuple
 import shutil
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 
 
 PROJECT_ROOT = Path(__file__).parent
+TRANSACTION_DATE_FORMAT = "%Y-%m-%d"
+CUSTOMER_COLUMNS = ["customer_id", "name", "email", "registration_date", "country", "age"]
+PRODUCT_COLUMNS = ["product_id", "product_name", "category", "price", "stock"]
+TRANSACTION_COLUMNS = ["transaction_id", "customer_id", "product_id", "quantity", "transaction_date", "payment_method"]
 
 
 def ensure_inputs_exist() -> Tuple[Path, Path, Path]:
@@ -41,108 +50,174 @@ def ensure_inputs_exist() -> Tuple[Path, Path, Path]:
 	return customers_csv, products_csv, transactions_csv
 
 
-def load_data(customers_csv: Path, products_csv: Path, transactions_csv: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-	customers_df = pd.read_csv(customers_csv, dtype={"customer_id": "string", "name": "string", "email": "string", "registration_date": "string", "country": "string", "age": "string"})
-	products_df = pd.read_csv(products_csv, dtype={"product_id": "string", "product_name": "string", "category": "string", "price": "string", "stock": "string"})
-	transactions_df = pd.read_csv(transactions_csv, dtype={"transaction_id": "string", "customer_id": "string", "product_id": "string", "quantity": "string", "transaction_date": "string", "payment_method": "string"})
-	return customers_df, products_df, transactions_df
+def string_convert_options(columns: List[str]) -> pv.ConvertOptions:
+	return pv.ConvertOptions(column_types={column: pa.string() for column in columns}, strings_can_be_null=True)
 
 
-def clean_customers(customers_df: pd.DataFrame) -> pd.DataFrame:
-	df = customers_df.copy()
+def read_csv_as_strings(csv_path: Path, columns: List[str]) -> pd.DataFrame:
+	read_options = pv.ReadOptions(block_size=64 << 20)
+	table = pv.read_csv(csv_path, read_options=read_options, convert_options=string_convert_options(columns))
+	return table.to_pandas(types_mapper=pd.ArrowDtype, split_blocks=True, self_destruct=True)
+
 
-	df = df.drop_duplicates()
+def to_canonical_categorical(values: pd.Series, canonical_map: dict) -> pd.Categorical:
+	# Normalise only the distinct raw values, then broadcast through the factorized codes.
+	codes, uniques = pd.factorize(values)
+	categories = [*canonical_map.values(), "Other"]
+	other_code = len(categories) - 1
+	keys = pd.Series(uniques).str.strip().str.lower().map(canonical_map)
+	unique_codes = keys.map({category: code for code, category in enumerate(categories)}).fillna(other_code).to_numpy(dtype=np.int8)
+	# Missing values factorize to -1, which picks the trailing "Other" code.
+	unique_codes = np.append(unique_codes, np.int8(other_code))
+	return pd.Categorical.from_codes(unique_codes[codes], categories=categories)
 
-	df["country"] = df["country"].astype("string").str.strip()
-	df["country"] = df["country"].replace({"USA": "United States", "US": "United States"})
 
-	age_numeric = df["age"].astype("string").str.extract(r"(\d+)")[0].astype("Int64")
-	df["age"] = age_numeric
+def clean_customers(customers_df: pd.DataFrame) -> pd.DataFrame:
+	df = customers_df.drop_duplicates()
+
+	country = df["country"].str.strip()
+	country = country.replace({"USA": "United States", "US": "United States"}).astype("category")
 
-	def synthesize_email(row: pd.Series) -> str:
-		if pd.notna(row.get("email")) and str(row["email"]).strip() != "":
-			return str(row["email"]).strip().lower()
-		name = str(row.get("name") or "").strip().lower()
-		customer_id = str(row.get("customer_id") or "").strip().lower()
-		if name:
-			parts = [p for p in name.replace("  ", " ").split(" ") if p]
-			local = ".".join(parts[:2]) if len(parts) >= 2 else (parts[0] if parts else "user")
-		else:
-			local = "user"
-		if customer_id:
-			local = f"{local}.{customer_id}"
-		return f"{local}@example.com"
+	age_numeric = df["age"].str.extract(r"(?P<age>\d+)")["age"].astype("Int64")
+	age_numeric = age_numeric.mask(age_numeric > 150).astype("Int16")
 
-	df["email"] = df.apply(synthesize_email, axis=1)
+	name = df["name"].fillna("").str.strip().str.lower()
+	local = name.str.replace(r"^(\S+)\s+(\S+).*$", r"\1.\2", regex=True)
+	local = local.where(local.ne(""), "user")
+	customer_id = df["customer_id"].fillna("").str.strip().str.lower()
+	local = local.where(customer_id.eq(""), local + "." + customer_id)
+	email = df["email"].str.strip().str.lower()
+	email = email.where(email.notna() & email.ne(""), local + "@example.com")
 
-	return df
+	df = df.assign(country=country, age=age_numeric, email=email)
+	# Repeats that only differed before normalisation (e.g. "48" vs "48 years") share a customer_id.
+	return df.drop_duplicates(subset=["customer_id"], keep="first")
 
 
 def clean_products(products_df: pd.DataFrame) -> pd.DataFrame:
-	df = products_df.copy()
+	df = products_df.drop_duplicates(subset=["product_id"], keep="first")
 
-	df["product_name"] = df["product_name"].astype("string").str.strip()
+	product_name = df["product_name"].str.strip()
 
 	canonical_categories = {"electronics": "Electronics", "clothing": "Clothing", "books": "Books", "home": "Home", "sports": "Sports"}
-	df["category"] = df["category"].astype("string").str.strip().str.lower().map(canonical_categories).fillna("Other")
+	category = pd.Series(to_canonical_categorical(df["category"], canonical_categories), index=df.index)
 
-	df["price"] = pd.to_numeric(df["price"], errors="coerce")
-	df.loc[df["price"] < 0, "price"] = np.nan
-	category_median_price = df.groupby("category")["price"].transform(lambda s: s.fillna(s.median()))
-	global_median_price = df["price"].median()
-	df["price"] = df["price"].fillna(category_median_price).fillna(global_median_price)
+	price = pd.to_numeric(df["price"], errors="coerce")
+	price = price.mask(price < 0)
+	category_median_price = price.groupby(category, observed=True).transform("median")
+	price = price.fillna(category_median_price).fillna(price.median())
 
-	df["stock"] = pd.to_numeric(df["stock"], errors="coerce").fillna(0).astype(int)
-	df.loc[df["stock"] > 1000, "stock"] = 1000
-	df.loc[df["stock"] < 0, "stock"] = 0
+	stock = pd.to_numeric(df["stock"], errors="coerce").fillna(0).astype(int)
+	stock = np.clip(stock.to_numpy(), 0, 1000).astype(np.int16)
 
-	return df
+	return df.assign(product_name=product_name, category=category, price=price, stock=stock)
 
 
-def clean_transactions(transactions_df: pd.DataFrame, valid_customer_ids: pd.Series) -> pd.DataFrame:
-	df = transactions_df.copy()
+def normalize_transactions(transactions_df: pd.DataFrame) -> pd.DataFrame:
+	# Row-wise cleaning only, so it can run on any slice of the transactions independently.
+	quantity = pd.to_numeric(transactions_df["quantity"], errors="coerce").fillna(1).astype(int)
+	quantity = pd.to_numeric(np.clip(quantity.to_numpy(), 1, None), downcast="integer")
 
-	if "transaction_id" in df.columns:
-		df = df.drop_duplicates(subset=["transaction_id"], keep="first")
-	else:
-		df = df.drop_duplicates()
+	transaction_date = pd.to_datetime(transactions_df["transaction_date"], errors="coerce", utc=False, format=TRANSACTION_DATE_FORMAT, cache=True)
+	transaction_date = transaction_date.clip(upper=pd.Timestamp("2024-12-31"))
 
-	df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce")
-	df["quantity"] = df["quantity"].fillna(1).astype(int)
-	df.loc[df["quantity"] < 1, "quantity"] = 1
+	method_map = {"credit card": "Credit Card", "paypal": "PayPal", "bank transfer": "Bank Transfer"}
+	payment_method = to_canonical_categorical(transactions_df["payment_method"], method_map)
 
-	df["transaction_date"] = pd.to_datetime(df["transaction_date"], errors="coerce", utc=False)
-	cutoff = pd.Timestamp("2024-12-31")
-	mask_future = df["transaction_date"] > cutoff
-	df.loc[mask_future, "transaction_date"] = cutoff
+	return transactions_df.assign(quantity=quantity, transaction_date=transaction_date, payment_method=payment_method)
 
-	method_map = {"CREDIT CARD": "Credit Card", "PAYPAL": "PayPal", "BANK TRANSFER": "Bank Transfer"}
-	df["payment_method"] = df["payment_method"].astype("string").str.strip().str.upper().map(method_map).fillna("Other")
 
-	df = df[df["customer_id"].isin(valid_customer_ids)]
+def drop_unknown_customers(transactions_df: pd.DataFrame, valid_customer_ids: pd.Series) -> pd.DataFrame:
+	customer_index = pd.Index(valid_customer_ids.dropna().unique())
+	return transactions_df[customer_index.get_indexer(transactions_df["customer_id"]) != -1]
 
-	return df
+
+def clean_transactions(transactions_df: pd.DataFrame, valid_customer_ids: pd.Series) -> pd.DataFrame:
+	if "transaction_id" in transactions_df.columns:
+		df = transactions_df.drop_duplicates(subset=["transaction_id"], keep="first")
+	else:
+		df = transactions_df.drop_duplicates()
+
+	df = normalize_transactions(df)
+	return drop_unknown_customers(df, valid_customer_ids)
+
+
+def clean_transactions_in_batches(transactions_csv: Path, valid_customer_ids: pd.Series, block_size: int = 16 << 20) -> pd.DataFrame:
+	# Streams the CSV block by block; a worker thread normalises batch k while batch k+1 is parsed.
+	read_options = pv.ReadOptions(block_size=block_size)
+	reader = pv.open_csv(transactions_csv, read_options=read_options, convert_options=string_convert_options(TRANSACTION_COLUMNS))
+	if "transaction_id" not in reader.schema.names:
+		# Without an id, duplicates are whole raw rows and can span batches, so clean the file in one go.
+		return clean_transactions(reader.read_all().to_pandas(types_mapper=pd.ArrowDtype), valid_customer_ids)
+
+	row_offset = 0
+	normalized_batches = []
+	pending = None
+	with ThreadPoolExecutor(max_workers=1) as executor:
+		for batch in reader:
+			batch_df = batch.to_pandas(types_mapper=pd.ArrowDtype)
+			batch_df.index = pd.RangeIndex(row_offset, row_offset + len(batch_df))
+			row_offset += len(batch_df)
+			if pending is not None:
+				normalized_batches.append(pending.result())
+			pending = executor.submit(normalize_transactions, batch_df)
+		if pending is not None:
+			normalized_batches.append(pending.result())
+	if not normalized_batches:
+		normalized_batches.append(normalize_transactions(reader.schema.empty_table().to_pandas(types_mapper=pd.ArrowDtype)))
+
+	# Normalisation leaves transaction_id untouched, so keep-first over the whole file matches clean_transactions.
+	df = pd.concat(normalized_batches).drop_duplicates(subset=["transaction_id"], keep="first")
+	return drop_unknown_customers(df, valid_customer_ids)
+
+
+def sum_by_month(dates: pd.Series, values: pd.Series) -> pd.DataFrame:
+	has_date = dates.notna()
+	dates = dates[has_date]
+	month_keys = dates.dt.year.to_numpy(dtype=np.int32) * 12 + dates.dt.month.to_numpy(dtype=np.int32) - 1
+	totals = values[has_date].groupby(month_keys).sum()
+	keys = totals.index.to_numpy()
+	months = pd.to_datetime(pd.DataFrame({"year": keys // 12, "month": keys % 12 + 1, "day": 1}))
+	return pd.DataFrame({"month": months, "revenue": totals.reset_index(drop=True)})
+
+
+def lookup_columns(keys: pd.Series, table: pd.DataFrame, key: str, columns: List[str]) -> dict:
+	# Positional lookup against a table with one row per key; unknown keys (-1) become missing values.
+	if not table[key].is_unique:
+		raise ValueError(f"Lookup key {key!r} must be unique; clean the table before computing analytics.")
+	positions = pd.Index(table[key]).get_indexer(keys)
+	return {column: pd.api.extensions.take(table[column].array, positions, allow_fill=True) for column in columns}
+
+
+def top_n(values: pd.Series, n: int) -> pd.Series:
+	# Partial selection keeps every value tied with the n-th largest; ties then resolve in key order like nlargest.
+	if len(values) > n:
+		negated = -values.to_numpy(dtype=np.float64, na_value=np.nan)
+		cutoff = np.partition(negated, n - 1)[n - 1]
+		if not np.isnan(cutoff):
+			values = values[negated <= cutoff]
+	return values.sort_index().sort_values(ascending=False, kind="stable").head(n)
 
 
 def compute_analytics(clean_transactions: pd.DataFrame, clean_products: pd.DataFrame, clean_customers: pd.DataFrame) -> dict:
-	merged = (
-		clean_transactions.merge(clean_products[["product_id", "price", "category"]], on="product_id", how="left")
-		.merge(clean_customers[["customer_id", "country"]], on="customer_id", how="left")
+	transactions = clean_transactions[["transaction_id", "customer_id", "product_id", "quantity", "transaction_date", "payment_method"]]
+	merged = transactions.assign(
+		**lookup_columns(transactions["product_id"], clean_products, "product_id", ["price", "category"]),
+		**lookup_columns(transactions["customer_id"], clean_customers, "customer_id", ["country"]),
 	)
-	merged["revenue"] = merged["quantity"] * merged["price"]
+	merged["revenue"] = merged["quantity"].to_numpy(dtype=np.float64) * merged["price"].to_numpy(dtype=np.float64, na_value=np.nan)
 
 	kpis = {}
 	kpis["total_revenue"] = float(merged["revenue"].sum())
 	kpis["avg_order_value"] = float(merged["revenue"].mean())
 
-	revenue_by_category = merged.groupby("category", dropna=False)["revenue"].sum().sort_values(ascending=False).reset_index()
-	revenue_by_country = merged.groupby("country", dropna=False)["revenue"].sum().sort_values(ascending=False).reset_index()
-	top_customers = merged.groupby("customer_id", dropna=False)["revenue"].sum().nlargest(5).reset_index()
-	monthly_revenue = (
-		merged.assign(month=merged["transaction_date"].dt.to_period("M").dt.to_timestamp())
-		.groupby("month")["revenue"].sum().reset_index().sort_values("month")
-	)
-	payment_share = merged.groupby("payment_method", dropna=False)["revenue"].sum().sort_values(ascending=False).reset_index()
+	revenue_cube = merged.groupby(["category", "country", "payment_method"], observed=True, dropna=False)["revenue"].sum()
+	revenue_by_category = revenue_cube.groupby(level="category", observed=True, dropna=False).sum().sort_values(ascending=False).reset_index()
+	revenue_by_country = revenue_cube.groupby(level="country", observed=True, dropna=False).sum().sort_values(ascending=False).reset_index()
+	customer_revenue = merged.groupby("customer_id", dropna=False, sort=False)["revenue"].sum()
+	top_customers = top_n(customer_revenue, 5).reset_index()
+	monthly_revenue = sum_by_month(merged["transaction_date"], merged["revenue"])
+	payment_share = revenue_cube.groupby(level="payment_method", observed=True, dropna=False).sum().sort_values(ascending=False).reset_index()
 
 	return {
 		"merged": merged,
@@ -155,29 +230,55 @@ def compute_analytics(clean_transactions: pd.DataFrame, clean_products: pd.DataF
 	}
 
 
-def save_outputs(clean_customers_df: pd.DataFrame, clean_products_df: pd.DataFrame, clean_transactions_df: pd.DataFrame, analytics: dict) -> None:
+def write_frame(df: pd.DataFrame, path_stem: Path, as_csv: bool = False) -> Path:
+	if as_csv:
+		path = path_stem.with_suffix(".csv")
+		df.to_csv(path, index=False)
+	else:
+		path = path_stem.with_suffix(".parquet")
+		table = pa.Table.from_pandas(df, preserve_index=False)
+		pq.write_table(table, path, compression="zstd", use_dictionary=True, row_group_size=256_000)
+	return path
+
+
+def save_outputs(clean_customers_df: pd.DataFrame, clean_products_df: pd.DataFrame, clean_transactions_df: pd.DataFrame, analytics: dict, as_csv: bool = False) -> None:
 	clean_dir = PROJECT_ROOT / "data" / "cleaned"
 	clean_dir.mkdir(parents=True, exist_ok=True)
-	clean_customers_df.to_csv(clean_dir / "customers_clean.csv", index=False)
-	clean_products_df.to_csv(clean_dir / "products_clean.csv", index=False)
-	clean_transactions_df.to_csv(clean_dir / "transactions_clean.csv", index=False)
+	write_frame(clean_customers_df, clean_dir / "customers_clean", as_csv)
+	write_frame(clean_products_df, clean_dir / "products_clean", as_csv)
+	write_frame(clean_transactions_df, clean_dir / "transactions_clean", as_csv)
 
 	output_dir = PROJECT_ROOT / "outputs"
 	output_dir.mkdir(exist_ok=True)
-	analytics["revenue_by_category"].to_csv(output_dir / "revenue_by_category.csv", index=False)
-	analytics["revenue_by_country"].to_csv(output_dir / "revenue_by_country.csv", index=False)
-	analytics["top_customers"].to_csv(output_dir / "top_customers.csv", index=False)
-	analytics["monthly_revenue"].to_csv(output_dir / "monthly_revenue.csv", index=False)
-	analytics["payment_share"].to_csv(output_dir / "payment_share.csv", index=False)
+	write_frame(analytics["revenue_by_category"], output_dir / "revenue_by_category", as_csv)
+	write_frame(analytics["revenue_by_country"], output_dir / "revenue_by_country", as_csv)
+	write_frame(analytics["top_customers"], output_dir / "top_customers", as_csv)
+	write_frame(analytics["monthly_revenue"], output_dir / "monthly_revenue", as_csv)
+	write_frame(analytics["payment_share"], output_dir / "payment_share", as_csv)
 
 
-def print_summary(clean_customers_df: pd.DataFrame, clean_products_df: pd.DataFrame, clean_transactions_df: pd.DataFrame, analytics: dict) -> None:
+def load_cleaned() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+	clean_dir = PROJECT_ROOT / "data" / "cleaned"
+	missing = [name for name in ["customers_clean.parquet", "products_clean.parquet", "transactions_clean.parquet"] if not (clean_dir / name).exists()]
+	if missing:
+		raise FileNotFoundError(
+			f"Missing cleaned files in data/cleaned: {', '.join(missing)}. "
+			"Please run: python project2_solution.py to produce them."
+		)
+	customers_df = pd.read_parquet(clean_dir / "customers_clean.parquet", engine="pyarrow")
+	products_df = pd.read_parquet(clean_dir / "products_clean.parquet", engine="pyarrow")
+	transactions_df = pd.read_parquet(clean_dir / "transactions_clean.parquet", engine="pyarrow")
+	return customers_df, products_df, transactions_df
+
+
+def print_summary(clean_customers_df: pd.DataFrame, clean_products_df: pd.DataFrame, clean_transactions_df: pd.DataFrame, analytics: dict, as_csv: bool = False) -> None:
+	ext = "csv" if as_csv else "parquet"
 	print("=" * 60)
 	print("Cleaned Data Summary")
 	print("=" * 60)
-	print(f"data/cleaned/customers_clean.csv: {len(clean_customers_df)} rows")
-	print(f"data/cleaned/products_clean.csv:  {len(clean_products_df)} rows")
-	print(f"data/cleaned/transactions_clean.csv: {len(clean_transactions_df)} rows")
+	print(f"data/cleaned/customers_clean.{ext}: {len(clean_customers_df)} rows")
+	print(f"data/cleaned/products_clean.{ext}:  {len(clean_products_df)} rows")
+	print(f"data/cleaned/transactions_clean.{ext}: {len(clean_transactions_df)} rows")
 	print()
 	print("=" * 60)
 	print("KPIs")
@@ -200,22 +301,31 @@ def print_summary(clean_customers_df: pd.DataFrame, clean_products_df: pd.DataFr
 	print("Outputs saved in: outputs/")
 
 
-def main() -> int:
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Clean the Project 2 CSVs and compute analytics.")
+	parser.add_argument("--csv", action="store_true", help="write cleaned data and analytics as CSV instead of Parquet")
+	args = parser.parse_args(argv)
+
 	try:
 		customers_csv, products_csv, transactions_csv = ensure_inputs_exist()
 	except FileNotFoundError as e:
 		print(str(e))
 		return 1
 
-	customers_df, products_df, transactions_df = load_data(customers_csv, products_csv, transactions_csv)
+	customers_df = read_csv_as_strings(customers_csv, CUSTOMER_COLUMNS)
+	products_df = read_csv_as_strings(products_csv, PRODUCT_COLUMNS)
 
-	clean_customers_df = clean_customers(customers_df)
-	clean_products_df = clean_products(products_df)
-	clean_transactions_df = clean_transactions(transactions_df, valid_customer_ids=clean_customers_df["customer_id"])
+	with ProcessPoolExecutor(max_workers=2) as executor:
+		customers_future = executor.submit(clean_customers, customers_df)
+		products_future = executor.submit(clean_products, products_df)
+		clean_customers_df = customers_future.result()
+		clean_products_df = products_future.result()
+	del customers_df, products_df
+	clean_transactions_df = clean_transactions_in_batches(transactions_csv, valid_customer_ids=clean_customers_df["customer_id"])
 
 	analytics = compute_analytics(clean_transactions_df, clean_products_df, clean_customers_df)
-	save_outputs(clean_customers_df, clean_products_df, clean_transactions_df, analytics)
-	print_summary(clean_customers_df, clean_products_df, clean_transactions_df, analytics)
+	save_outputs(clean_customers_df, clean_products_df, clean_transactions_df, analytics, as_csv=args.csv)
+	print_summary(clean_customers_df, clean_products_df, clean_transactions_df, analytics, as_csv=args.csv)
 	return 0
 
 